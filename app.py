@@ -1,13 +1,15 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
+import re
 import time
+import queue
+import random
+import atexit
+import functools
+import threading
 from datetime import datetime
-import gspread
-from google.oauth2.service_account import Credentials
-import altair as alt
 import pytz
-import plotly.express as px
-import plotly.graph_objects as go
 # Page configuration
 st.set_page_config(page_title="Tasks Monitor", page_icon="🖥️", layout="wide")
 
@@ -40,10 +42,16 @@ if not st.session_state.authenticated:
         
     st.stop() # Block app execution
 
+# Google client and plotly libraries are heavy; the login page above never needs them
+import gspread
+from google.oauth2.service_account import Credentials
+import plotly.express as px
+import plotly.graph_objects as go
+
 
 
-# Custom CSS for premium look
-st.markdown("""
+# Custom CSS for premium look + [AG] alignment fixes (one block, sent once per run)
+APP_CSS = """
     <style>
     .stButton>button {
         width: 100%;
@@ -53,8 +61,67 @@ st.markdown("""
     .stTextInput>div>div>input {
         border-radius: 5px;
     }
+    
+    /* [AG] Universal Alignment Fix */
+    
+    /* 1. Target the Horizontal Block to align items vertically center */
+    div[data-testid="stHorizontalBlock"] {
+        align-items: center !important;
+    }
+    
+    /* 2. Force ALL Input-like containers to exactly 35px height */
+    /* Text Input, Date Input, Selectbox, MultiSelect */
+    
+    div[data-testid="stTextInput"] div[data-baseweb="input"],
+    div[data-testid="stDateInput"] div[data-baseweb="input"], 
+    div[data-testid="stSelectbox"] div[data-baseweb="select"],
+    div[data-testid="stMultiSelect"] div[data-baseweb="select"] {
+        height: 35px !important;
+        min-height: 35px !important;
+        max-height: 35px !important;
+        border-radius: 4px !important;
+        overflow: hidden !important; /* Prevent chip spillover */
+        display: flex !important;
+        align-items: center !important;
+    }
+
+    /* 3. Button specific overrides */
+    div[data-testid="stButton"] button {
+        height: 35px !important;
+        min-height: 35px !important;
+        max-height: 35px !important;
+        padding: 0px 16px !important;
+        line-height: normal !important; /* Let flex center it */
+        border: 1px solid rgba(250, 250, 250, 0.2);
+        border-radius: 4px !important;
+        display: flex !important;
+        align-items: center !important;
+        justify-content: center !important;
+    }
+    
+    /* 4. Fix input text padding to center text vertically */
+    input {
+        padding-top: 0px !important;
+        padding-bottom: 0px !important;
+        height: 100% !important;
+    }
+    
+    /* 5. Checkbox alignment */
+    label[data-testid="stCheckbox"] {
+        height: 35px !important;
+        display: flex !important;
+        align-items: center !important;
+    }
+    
+    /* 6. Fix for MultiSelect chips pushing height */
+    div[data-baseweb="tag"] {
+        margin-top: 0px !important;
+        margin-bottom: 0px !important;
+        height: 24px !important; /* Smaller chips to fit in 35px */
+    }
     </style>
-    """, unsafe_allow_html=True)
+    """
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 
 # Constants
@@ -63,6 +130,17 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive",
 ]
 
+# Background writes: flush after this many seconds without new writes, or once this many are queued
+WRITE_DEBOUNCE = 0.5
+WRITE_BATCH_MAX = 50
+# Quota (429) / transient server errors on a write are retried with exponential backoff (with_backoff)
+WRITE_RETRIES = 5
+RETRY_STATUS = (429, 500, 502, 503)
+# Appends, row deletes and sheet creation aren't idempotent: a 5xx may already have been applied, a 429 never was
+RETRY_QUOTA_ONLY = (429,)
+# Task row updates/deletes address rows by position, so they're only safe while the session is in step with the sheet
+POSITIONAL_OPS = ("update_row", "delete_row")
+
 # Timezone
 MADRID_TZ = pytz.timezone('Europe/Madrid')
 
@@ -70,6 +148,8 @@ MADRID_TZ = pytz.timezone('Europe/Madrid')
 # Removed 'status' as per user request (Option A)
 # Updated to English Title Case Headers (Standardization)
 REQUIRED_COLUMNS = ['ID', 'Task', 'Category', 'Duration', 'Start Epoch', 'Notes', 'Date Created', 'Archived', 'Date Archived']
+LAST_COLUMN = chr(ord('A') + len(REQUIRED_COLUMNS) - 1) # 'I'
+LOG_COLUMNS = ["ID", "Task", "Category", "Start Time", "End Time", "Duration"]
 
 DEFAULT_CATEGORIES = [
     "Gestión de la demanda",
@@ -78,16 +158,23 @@ DEFAULT_CATEGORIES = [
 ]
 
 # Helper: Format seconds to HH:MM:SS
+# Callers pass numbers: 'total_seconds' is kept as whole seconds (int); live elapsed may be a float
 def format_time(seconds):
-    try:
-        # Handle string floats "12.5" -> 12
-        val = int(float(seconds))
-    except:
-        val = 0
-    m, s = divmod(val, 60)
+    return _format_whole_seconds(int(seconds))
+
+@functools.lru_cache(maxsize=8192)
+def _format_whole_seconds(total):
+    m, s = divmod(total, 60)
     h, m = divmod(m, 60)
     return f"{h:02d}:{m:02d}:{s:02d}"
 
+# Helper: Vectorized format_time for a list/Series of seconds (keeps the Series index)
+def format_time_series(seconds):
+    total = pd.Series(seconds).fillna(0).astype('int64')
+    h, rem = total // 3600, total % 3600
+    m, s = rem // 60, rem % 60
+    return h.astype(str).str.zfill(2) + ":" + m.astype(str).str.zfill(2) + ":" + s.astype(str).str.zfill(2)
+
 # Helper: Find credentials dictionary recursively
 def find_credentials(secrets_proxy):
     # ... (content remains same, just ensuring format_time is above) ...
@@ -105,8 +192,21 @@ def find_credentials(secrets_proxy):
                     return subval
     return None
 
-def get_gc():
+@functools.lru_cache(maxsize=1)
+def _resolve_creds():
+    """Walk st.secrets once per process. Returns (credentials section or None, spreadsheet URL)."""
     secrets = find_credentials(st.secrets)
+    url = secrets.get("spreadsheet") if secrets else None
+    if not url:
+        if "spreadsheet" in st.secrets: url = st.secrets["spreadsheet"]
+        elif "connections" in st.secrets and "gsheets" in st.secrets.connections:
+            url = st.secrets.connections.gsheets.get("spreadsheet")
+    return secrets, url
+
+@st.cache_resource
+def get_gc():
+    """Authorize once per process; the client (and its HTTP session) is reused across reruns."""
+    secrets, _ = _resolve_creds()
     
     if not secrets:
         st.error("❌ Credentials not found.")
@@ -133,16 +233,231 @@ def get_gc():
     creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
     return gspread.authorize(creds)
 
+def get_spreadsheet_url():
+    _, url = _resolve_creds()
+    return url
+
+@st.cache_resource
+def get_spreadsheet(url):
+    """Open the spreadsheet once per process (open_by_url costs a metadata round-trip)."""
+    return get_gc().open_by_url(url)
+
+@st.cache_resource
+def get_worksheet(url, sheet_index=0):
+    """Keep the worksheet handle across reruns."""
+    return get_spreadsheet(url).get_worksheet(sheet_index)
+
+def with_backoff(fn, *args, retry_on=RETRY_STATUS, **kwargs):
+    """Run one sheet API call, backing off (1, 2, 4, ... s plus jitter) on the HTTP statuses in `retry_on`."""
+    for attempt in range(WRITE_RETRIES):
+        try:
+            return fn(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            status = getattr(e.response, 'status_code', None)
+            if status not in retry_on or attempt == WRITE_RETRIES - 1:
+                raise
+            time.sleep(min(32, 2 ** attempt) + random.random())
+
+class SheetWriter:
+    """Applies queued sheet writes on a background thread so queuing a write never blocks on the network.
+
+    Writes arriving within WRITE_DEBOUNCE seconds of each other are flushed together:
+    consecutive row updates become one batch_update, consecutive appends one append_rows.
+    Row updates/deletes are first checked against the rows they target (_drop_moved_rows).
+    Each coalesced run succeeds or fails on its own: a failure is reported to the sessions
+    that queued it and the rest of the batch is still applied. Those sessions are then out
+    of step with that worksheet, so their row updates/deletes on it are dropped until they
+    rewrite it (replace_all).
+    """
+    def __init__(self):
+        self.queue = queue.Queue()
+        self._out_of_sync = {} # (id(worksheet), id(errors)) -> errors (held so the id can't be reused)
+        self._thread = threading.Thread(target=self._run, name="sheet-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def put(self, op, worksheet, *args, errors=None):
+        """Queue a write; if it fails, (worksheet, message) is appended to `errors` (the queuing session's list)."""
+        self.queue.put((op, worksheet, args, errors))
+
+    def wait(self):
+        """Block until every queued write has been applied (used before reading the sheet back).
+
+        While the API is throttling this includes the writes' retry backoff (up to ~15 s per call),
+        so a cache-miss read can stall a rerun; reading earlier would cache rows about to change.
+        """
+        self.queue.join()
+
+    def flush(self, timeout=10):
+        """Give queued writes (e.g. the latest Logs rows) up to `timeout` seconds to land; runs at process exit."""
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.1)
+
+    def _run(self):
+        while True:
+            ops = [self.queue.get()]
+            # Debounce: keep draining while writes arrive in quick succession
+            while len(ops) < WRITE_BATCH_MAX:
+                try:
+                    ops.append(self.queue.get(timeout=WRITE_DEBOUNCE))
+                except queue.Empty:
+                    break
+            try:
+                self._apply(ops)
+            finally:
+                for _ in ops:
+                    self.queue.task_done()
+
+    def _apply(self, ops):
+        # Coalesce runs of the same kind on the same worksheet, keeping overall order
+        i = 0
+        while i < len(ops):
+            op, ws = ops[i][:2]
+            j = i + 1
+            while j < len(ops) and ops[j][0] == op and ops[j][1] is ws and op in ("update_row", "append_row"):
+                j += 1
+            run = ops[i:j]
+            if op == "replace_all":
+                # A full rewrite puts its session back in step with the sheet
+                self._out_of_sync.pop((id(ws), id(run[0][3])), None)
+            elif op in POSITIONAL_OPS:
+                # Row numbers from a session whose earlier write failed may now point at other rows
+                run = [o for o in run if (id(ws), id(o[3])) not in self._out_of_sync]
+            if run:
+                try:
+                    if op in POSITIONAL_OPS:
+                        run = self._drop_moved_rows(ws, run)
+                    if run:
+                        self._apply_run(op, ws, [a for _, _, a, _ in run])
+                except Exception as e:
+                    # Tell each session with an op in the failed run (once), then carry on with the batch
+                    sinks = {id(sink): sink for _, _, _, sink in run if sink is not None}
+                    for sink in sinks.values():
+                        sink.append((ws, str(e)))
+                        self._out_of_sync[(id(ws), id(sink))] = sink
+            i = j
+
+    def _drop_moved_rows(self, ws, run):
+        """Check that each row a positional run targets still holds the task its session expects there.
+
+        The last arg of update_row/delete_row is the (ID, Task, Category) the session last saw in that row;
+        all target rows are read back with one batch_get. A session whose rows no longer match (the sheet
+        was edited by hand or from another session) is told and put out of sync, so it rewrites the sheet
+        instead; the ops of the sessions that still match are returned.
+        """
+        rows = sorted({args[0] for _, _, args, _ in run})
+        found = dict(zip(rows, with_backoff(ws.batch_get, [f"A{r}:C{r}" for r in rows])))
+        moved, seen = {}, set()
+        for _, _, args, sink in run:
+            if (id(sink), args[0]) in seen:
+                continue # A later update of the same row expects the earlier update's values
+            seen.add((id(sink), args[0]))
+            cells = [str(v).strip() for v in (found[args[0]][0] if found[args[0]] else [])]
+            if (cells + ["", "", ""])[:3] != list(args[-1]):
+                moved.setdefault(id(sink), (sink, args[0]))
+        for sink, row_number in moved.values():
+            if sink is not None:
+                sink.append((ws, f"row {row_number} no longer holds the expected task (edited in the sheet or another tab?), rewriting the sheet from this session"))
+                self._out_of_sync[(id(ws), id(sink))] = sink
+        return [o for o in run if id(o[3]) not in moved]
+
+    def _apply_run(self, op, ws, run):
+        """Apply one coalesced run of `op` on `ws`; `run` holds the queued args of each op."""
+        if op == "update_row":
+            rows = {}
+            for row_number, values, _ in run:
+                rows[row_number] = values # Last write wins
+            with_backoff(ws.batch_update, [
+                {'range': f"A{r}:{LAST_COLUMN}{r}", 'values': [v]} for r, v in sorted(rows.items())
+            ])
+        elif op == "append_row":
+            # RAW: no server-side parsing of the values
+            # table_range A1: always append right after the table that starts at A1 (task i = row i + 2)
+            with_backoff(ws.append_rows, [values for (values,) in run], value_input_option='RAW', table_range='A1', retry_on=RETRY_QUOTA_ONLY)
+        elif op == "delete_row":
+            with_backoff(ws.delete_rows, run[0][0], retry_on=RETRY_QUOTA_ONLY)
+        elif op == "replace_all":
+            with_backoff(ws.clear)
+            with_backoff(ws.update, run[0][0])
+
+@st.cache_resource
+def get_log_worksheet(url):
+    """Get (or create with headers) the 'Logs' worksheet once per process, migrating legacy headers.
+
+    Only the Logs paths (fetch_log_rows, log_session) call this, so a Logs failure never blocks tasks.
+    """
+    sh = get_spreadsheet(url)
+    try:
+        ws_logs = sh.worksheet("Logs")
+    except gspread.WorksheetNotFound:
+        # Create the sheet and write its header in one batchUpdate (add_worksheet + append_row would be two writes).
+        # updateCells must name the new sheet's id, so pick it here instead of letting the API assign one.
+        sheet_id = random.randrange(1, 2**31)
+        reply = with_backoff(sh.batch_update, {"requests": [
+            {"addSheet": {"properties": {
+                "sheetId": sheet_id, "title": "Logs", "sheetType": "GRID",
+                "gridProperties": {"rowCount": 1000, "columnCount": len(LOG_COLUMNS)},
+            }}},
+            {"updateCells": {
+                "start": {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": 0},
+                "rows": [{"values": [{"userEnteredValue": {"stringValue": h}} for h in LOG_COLUMNS]}],
+                "fields": "userEnteredValue",
+            }},
+        ]}, retry_on=RETRY_QUOTA_ONLY)
+        # Same handle add_worksheet builds from the reply, so no extra metadata read
+        return gspread.Worksheet(sh, reply["replies"][0]["addSheet"]["properties"], sh.id, sh.client)
+    
+    # Old: ["ID", "Descripción", "Categoría", "Fecha Inicio", "Fecha Fin", "Tiempo"]
+    # New: ["ID", "Task", "Category", "Start Time", "End Time", "Duration"]
+    current_headers = ws_logs.row_values(1)
+    if len(current_headers) < 2 or current_headers[1] != "Task":
+        with_backoff(ws_logs.update, range_name="A1:F1", values=[LOG_COLUMNS])
+    return ws_logs
+
+@st.cache_resource
+def get_writer():
+    return SheetWriter()
+
+@st.cache_resource
+def ensure_schema(url):
+    """One-time task sheet migration per process, so no click pays for it: the task worksheet is named 'General'."""
+    worksheet = get_worksheet(url)
+    if worksheet.title != "General":
+        with_backoff(worksheet.update_title, "General")
+    return True
+
 # Helper: Parse HH:MM:SS to seconds
+TIME_RE = re.compile(r'\s*(\d+):(\d+):(\d+)\s*')
+
+@functools.lru_cache(maxsize=8192)
 def parse_time_str(time_str):
+    m = TIME_RE.fullmatch(str(time_str))
+    if m:
+        return int(m[1]) * 3600 + int(m[2]) * 60 + int(m[3])
+    return 0
+
+# Helper: Parse DD/MM/YYYY (as stored in 'Date Created') to a date, or None
+@functools.lru_cache(maxsize=4096)
+def parse_date_str(date_str):
+    try:
+        return datetime.strptime(date_str, "%d/%m/%Y").date()
+    except (TypeError, ValueError):
+        return None
+
+@st.cache_resource
+def get_category_worksheet(url):
+    """Get (or create) the 'Categories' worksheet once per process."""
+    sh = get_spreadsheet(url)
     try:
-        parts = str(time_str).split(':')
-        if len(parts) == 3:
-            h, m, s = map(int, parts)
-            return h * 3600 + m * 60 + s
-    except:
-        pass
-    return 0.0
+        return sh.worksheet("Categories")
+    except gspread.WorksheetNotFound:
+        return with_backoff(sh.add_worksheet, title="Categories", rows=100, cols=2, retry_on=RETRY_QUOTA_ONLY)
+
+# Shared across sessions like fetch_task_rows; every category write clears it
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_category_rows(url):
+    return get_category_worksheet(url).get_all_values()
 
 def load_categories():
     """Load categories from 'Categories' worksheet OR initialize with defaults."""
@@ -154,84 +469,66 @@ def load_categories():
     if 'categories_list' not in st.session_state:
         # Try loading from sheet
         try:
-            gc = get_gc()
-            secrets = find_credentials(st.secrets)
-            url = secrets.get("spreadsheet") if secrets else None
-            if not url and "spreadsheet" in st.secrets: url = st.secrets["spreadsheet"]
+            url = get_spreadsheet_url()
             
             if url:
-                sh = gc.open_by_url(url)
-                try:
-                    ws_cat = sh.worksheet("Categories")
-                    # Read all values including Description
-                    all_rows = ws_cat.get_all_values()
+                # Read all values including Description
+                all_rows = fetch_category_rows(url)
+                if not all_rows:
+                     # Empty (or just created) sheet -> Populate defaults
+                     fetch_category_rows.clear()
+                     # Header + defaults in one write
+                     with_backoff(
+                         get_category_worksheet(url).update,
+                         range_name="A1",
+                         values=[["Category", "Description"]] + [[c, ""] for c in DEFAULT_CATEGORIES],
+                         value_input_option='RAW',
+                     )
+                     st.session_state.categories_list = DEFAULT_CATEGORIES
+                     st.session_state.categories_desc = {c: "" for c in DEFAULT_CATEGORIES}
+                else:
+                    # Parse Rows
+                    # Header is row 0
+                    data_rows = all_rows[1:]
+                    loaded_list = []
+                    loaded_desc = {}
                     
-                    if not all_rows:
-                         # Empty sheet -> Populate defaults
-                         ws_cat.clear()
-                         ws_cat.append_row(["Category", "Description"])
-                         for c in DEFAULT_CATEGORIES:
-                             ws_cat.append_row([c, ""])
+                    for row in data_rows:
+                        if not row: continue
+                        c_name = row[0].strip()
+                        if c_name:
+                            loaded_list.append(c_name)
+                            c_desc = row[1] if len(row) > 1 else ""
+                            loaded_desc[c_name] = c_desc
+                            
+                    if not loaded_list:
                          st.session_state.categories_list = DEFAULT_CATEGORIES
                          st.session_state.categories_desc = {c: "" for c in DEFAULT_CATEGORIES}
                     else:
-                        # Parse Rows
-                        # Header is row 0
-                        data_rows = all_rows[1:]
-                        loaded_list = []
-                        loaded_desc = {}
-                        
-                        for row in data_rows:
-                            if not row: continue
-                            c_name = row[0].strip()
-                            if c_name:
-                                loaded_list.append(c_name)
-                                c_desc = row[1] if len(row) > 1 else ""
-                                loaded_desc[c_name] = c_desc
-                                
-                        if not loaded_list:
-                             st.session_state.categories_list = DEFAULT_CATEGORIES
-                             st.session_state.categories_desc = {c: "" for c in DEFAULT_CATEGORIES}
-                        else:
-                             st.session_state.categories_list = loaded_list
-                             st.session_state.categories_desc = loaded_desc
-
-                except gspread.WorksheetNotFound:
-                    # Create it
-                    ws_cat = sh.add_worksheet(title="Categories", rows=100, cols=2)
-                    ws_cat.append_row(["Category", "Description"])
-                    for c in DEFAULT_CATEGORIES:
-                        ws_cat.append_row([c, ""])
-                    st.session_state.categories_list = DEFAULT_CATEGORIES
-                    st.session_state.categories_desc = {c: "" for c in DEFAULT_CATEGORIES}
+                         st.session_state.categories_list = loaded_list
+                         st.session_state.categories_desc = loaded_desc
             else:
                 st.session_state.categories_list = DEFAULT_CATEGORIES
                 st.session_state.categories_desc = {c: "" for c in DEFAULT_CATEGORIES}
-        except:
-            st.session_state.categories_list = DEFAULT_CATEGORIES
-            st.session_state.categories_desc = {c: "" for c in DEFAULT_CATEGORIES}
-
+        except gspread.exceptions.GSpreadException as e: # API errors (incl. quota) and missing-sheet lookups
+            st.error(f"Error loading categories, using the defaults: {e}")
             st.session_state.categories_list = DEFAULT_CATEGORIES
             st.session_state.categories_desc = {c: "" for c in DEFAULT_CATEGORIES}
 
 def save_categories():
     """Persist current categories_list and categories_desc to Sheet."""
     try:
-        gc = get_gc()
-        secrets = find_credentials(st.secrets)
-        url = secrets.get("spreadsheet") if secrets else None
-        if not url and "spreadsheet" in st.secrets: url = st.secrets["spreadsheet"]
+        url = get_spreadsheet_url()
         if url:
-            sh = gc.open_by_url(url)
-            ws = sh.worksheet("Categories")
-            ws.clear()
-            ws.append_row(["Category", "Description"])
+            fetch_category_rows.clear()
+            ws = get_category_worksheet(url)
             
-            # Bulk update
+            # Header + rows in one write, then blank whatever the old list left below it
+            rows = [["Category", "Description"]]
             if 'categories_list' in st.session_state:
-                 rows = [[c, st.session_state.categories_desc.get(c, "")] for c in st.session_state.categories_list]
-                 if rows:
-                     ws.update(f"A2:B{len(rows)+1}", rows)
+                 rows += [[c, st.session_state.categories_desc.get(c, "")] for c in st.session_state.categories_list]
+            with_backoff(ws.update, range_name="A1", values=rows, value_input_option='RAW')
+            with_backoff(ws.batch_clear, [f"A{len(rows)+1}:B"])
     except Exception as e:
         print(f"Error saving categories: {e}")
 
@@ -241,8 +538,15 @@ def add_category(new_cat_name, new_cat_desc=""):
         if 'categories_desc' not in st.session_state: st.session_state.categories_desc = {}
         st.session_state.categories_desc[new_cat_name] = new_cat_desc
         
-        # Persist
-        save_categories()
+        # Persist (one appended row)
+        try:
+            url = get_spreadsheet_url()
+            if url:
+                fetch_category_rows.clear()
+                ws = get_category_worksheet(url)
+                with_backoff(ws.append_row, [new_cat_name, new_cat_desc], value_input_option='RAW', table_range='A1', retry_on=RETRY_QUOTA_ONLY)
+        except Exception as e:
+            print(f"Error saving categories: {e}")
         st.toast(f"Category '{new_cat_name}' added!", icon="✅")
 
 def remove_category(cat_name):
@@ -251,8 +555,19 @@ def remove_category(cat_name):
         if 'categories_desc' in st.session_state:
              st.session_state.categories_desc.pop(cat_name, None)
              
-        # Persist (Overwrite list)
-        save_categories()
+        # Persist (delete just its row; look it up since the sheet may contain blank rows)
+        try:
+            url = get_spreadsheet_url()
+            if url:
+                fetch_category_rows.clear()
+                ws = get_category_worksheet(url)
+                names = [v.strip() for v in ws.col_values(1)] # load_categories strips the names too
+                if cat_name.strip() in names[1:]:
+                    with_backoff(ws.delete_rows, names.index(cat_name.strip(), 1) + 1, retry_on=RETRY_QUOTA_ONLY)
+                else:
+                    st.error(f"Category '{cat_name}' was not found in the Categories sheet; it was only removed from this session.")
+        except Exception as e:
+            print(f"Error saving categories: {e}")
         st.toast(f"Category '{cat_name}' removed!", icon="🗑️")
 
 
@@ -279,9 +594,10 @@ def update_category(old_name, new_name, new_desc):
     # We iterate all tasks and update category if it matches old_name
     updated_tasks = False
     if st.session_state.tasks:
-        for t in st.session_state.tasks:
+        for i, t in enumerate(st.session_state.tasks):
             if t.get('category') == old_name:
                 t['category'] = new_name
+                mark_task_dirty(i)
                 updated_tasks = True
     
     # 4. Save
@@ -291,107 +607,225 @@ def update_category(old_name, new_name, new_desc):
     
     st.toast(f"✅ Category updated: {old_name} -> {new_name}", icon="✨")
 
+# Shared across sessions like fetch_task_rows; log_session and "Refresh Data" clear it
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_log_rows(url):
+    get_writer().wait() # Include sessions still queued for the Logs sheet
+    return get_log_worksheet(url).get_all_values() # Creates Logs / migrates its headers once per process
+
+LOGS_RETRY_AFTER = 30 # seconds to wait before retrying a failed Logs load (unless forced)
+
 def ensure_logs_loaded(force=False):
     """Ensure logs_data is loaded in session state."""
+    if force:
+        fetch_log_rows.clear()
+    elif time.time() - st.session_state.get("_logs_failed_at", 0) < LOGS_RETRY_AFTER:
+        # Circuit breaker: don't hammer the API on every rerun right after a failure.
+        # logs_data stays None (tabs show it as empty), so the load is retried once the window passes.
+        return
     if force or "logs_data" not in st.session_state or st.session_state.logs_data is None:
         try:
-            gc = get_gc()
-            secrets = find_credentials(st.secrets)
-            url = secrets.get("spreadsheet") if secrets else None
-            if not url and "spreadsheet" in st.secrets: url = st.secrets["spreadsheet"]
+            url = get_spreadsheet_url()
             
             if url:
-                sh = gc.open_by_url(url)
-                try:
-                    ws_logs = sh.worksheet("Logs")
-                    data = ws_logs.get_all_values()
-                    
-                    # ---------------------------------------------------------
-                    # HEADER FIX / MIGRATION
-                    # ---------------------------------------------------------
-                    # Old: ["ID", "Descripción", "Categoría", "Fecha Inicio", "Fecha Fin", "Tiempo"]
-                    # New: ["ID", "Task", "Category", "Start Time", "End Time", "Duration"]
-                    NEW_HEADERS = ["ID", "Task", "Category", "Start Time", "End Time", "Duration"]
-                    need_header_update = False
-                    
-                    if not data:
-                        need_header_update = True
-                    else:
-                        current_headers = data[0]
-                        # Check if headers match new standard. If not (e.g. Spanish or lowercase), update.
-                        # Simple check: Is 2nd col "Task"?
-                        if len(current_headers) < 2 or current_headers[1] != "Task":
-                            need_header_update = True
+                data = fetch_log_rows(url)
+                
+                if data:
+                    headers = pd.Index(data[0])
+                    keep = headers.str.strip() != "" # Drop unnamed (blank header) columns
                     
-                    if need_header_update:
-                        if not data:
-                            ws_logs.append_row(NEW_HEADERS)
-                        else:
-                            # Update header row
-                            ws_logs.update(range_name="A1:F1", values=[NEW_HEADERS])
-                        data = ws_logs.get_all_values()
-                        st.toast("✅ Updated Logs Headers to standard English format.", icon="🛠️")
-
-                    if data:
-                        raw_headers = data[0]
-                        raw_rows = data[1:]
-                        valid_indices = [i for i, h in enumerate(raw_headers) if h.strip()]
-                        
-                        if valid_indices:
-                            clean_headers = [raw_headers[i] for i in valid_indices]
-                            clean_rows = [[r[i] if i < len(r) else "" for i in valid_indices] for r in raw_rows]
-                            st.session_state.logs_data = pd.DataFrame(clean_rows, columns=clean_headers)
-                        else:
-                             st.session_state.logs_data = pd.DataFrame()
+                    if keep.any():
+                        # reindex/fillna pad short rows; the column mask is applied in one pass
+                        logs = pd.DataFrame(data[1:]).reindex(columns=range(len(headers)), fill_value="").fillna("")
+                        logs.columns = headers
+                        st.session_state.logs_data = logs.loc[:, keep]
                     else:
-                        st.session_state.logs_data = pd.DataFrame()
-                except gspread.WorksheetNotFound:
-                     st.session_state.logs_data = pd.DataFrame()
+                         st.session_state.logs_data = pd.DataFrame()
+                else:
+                    st.session_state.logs_data = pd.DataFrame()
             else:
                  st.session_state.logs_data = pd.DataFrame()
         except Exception as e:
             st.warning(f"Error loading logs: {e}")
-            st.session_state.logs_data = pd.DataFrame()
+            st.session_state.logs_data = None
+            st.session_state._logs_failed_at = time.time()
+
+# Every Stop makes a new logs snapshot: keep only the latest few prepared copies
+@st.cache_data(show_spinner=False, max_entries=4)
+def prepare_logs(logs):
+    """Derived columns shared by the Analytics and Logs tabs, computed once per logs snapshot."""
+    df_log = logs.copy()
+    # Schema: ["ID", "Task", "Category", "Start Time", "End Time", "Duration"]
+    df_log['Category'] = df_log['Category'].astype('category') # Few distinct values: integer-code groupbys
+    df_log['Seconds'] = df_log['Duration'].map(parse_time_str)
+    # Format in Sheet is "DD/MM/YYYY HH:MM:SS" from log_session
+    df_log['StartDT'] = pd.to_datetime(df_log['Start Time'], format="%d/%m/%Y %H:%M:%S", errors='coerce')
+    df_log['Date'] = df_log['StartDT'].dt.date
+    # Week buckets for the heatmap / evolution charts, labelled "06 Jan"
+    df_log['WeekStart'] = df_log['StartDT'].dt.to_period('W').dt.start_time
+    df_log['WeekLabel'] = df_log['WeekStart'].dt.strftime("%d %b")
+    return df_log
+
+# Analytics figures. The Sankey and heatmap are cheap to build: caching a go.Figure is slower than rebuilding it,
+# since unpickling re-runs plotly's validation. Only the px.bar spec is worth caching (as a plain dict).
+def sankey_figure(sankey_data):
+    sankey_data = sankey_data.copy()
+    # Calculate Total Flow calculation for %
+    total_flow_seconds = sankey_data['Seconds'].sum()
+    sankey_data['Percentage'] = (sankey_data['Seconds'] / total_flow_seconds) * 100
+    sankey_data['Formatted'] = format_time_series(sankey_data['Seconds'])
+    
+    all_cats = list(sankey_data['Category'].unique())
+    all_tasks = list(sankey_data['Task'].unique())
+    node_labels = all_cats + all_tasks
+    node_map = {label: i for i, label in enumerate(node_labels)}
+    
+    sources = sankey_data['Category'].astype(str).map(node_map).tolist() # categorical .map would yield floats
+    targets = sankey_data['Task'].map(node_map).tolist()
+    values = (sankey_data['Seconds'] / 3600.0).tolist() # Visual thickness
+    
+    # Prepare Custom Data: [formatted_time, percentage]
+    # We need to map it carefully or just pre-format a string?
+    # Sankey customdata must be list (or array) of length equal to links.
+    # Let's format the hover string directly here for clarity?
+    # Actually, Plotly suggests passing raw data and formatting in template.
+    # Let's pass list of lists: [[time, pct], [time, pct]...]
+    
+    # Zip to list of lists
+    custom_data = sankey_data[['Formatted', 'Percentage']].values.tolist()
+    
+    fig_sankey = go.Figure(data=[go.Sankey(
+        node = dict(
+          pad = 15,
+          thickness = 20,
+          line = dict(color = "black", width = 0.5),
+          label = node_labels,
+          color = "rgba(46, 204, 113, 0.5)",
+        ),
+        link = dict(
+          source = sources,
+          target = targets,
+          value = values,
+          customdata = custom_data,
+          # %{customdata[0]} = Formatted Time, %{customdata[1]} = Percentage (raw float)
+          hovertemplate='Source: %{source.label}<br>Target: %{target.label}<br>Time: %{customdata[0]}<br>Share: %{customdata[1]:.1f}%<extra></extra>',
+          color = "rgba(200, 200, 200, 0.3)" 
+      ))])
+    
+    fig_sankey.update_layout(title_text="", font_size=12, height=400, margin=dict(l=0, r=0, t=10, b=10))
+    return fig_sankey
+
+def heatmap_figure(heat_data):
+    days_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+    
+    # Create full grid for Heatmap
+    if not heat_data.empty:
+         # Pivot on WeekLabel (Formatted String)
+         # We must carry sorting by also pivoting on WeekStart and then replacing index? 
+         # Easier: Just pivot on `WeekLabel`. Sorting relies on `x` argument in Heatmap.
+         
+         # To ensure correct sort order of "06 Jan", "13 Jan", we need unique list sorted by date
+         week_map = heat_data[['WeekStart', 'WeekLabel']].drop_duplicates().sort_values('WeekStart')
+         sorted_labels = week_map['WeekLabel'].tolist()
+         
+         z_matrix = heat_data.pivot(index='Day', columns='WeekLabel', values='Hours').reindex(index=days_order, columns=sorted_labels)
+         text_matrix = heat_data.pivot(index='Day', columns='WeekLabel', values='Formatted').reindex(index=days_order, columns=sorted_labels).fillna("0s")
+         
+         z_values = z_matrix.fillna(0).values
+         
+         fig_heat = go.Figure(data=go.Heatmap(
+             z=z_values,
+             x=z_matrix.columns, # Now these are strings "06 Jan", "13 Jan"
+             y=z_matrix.index,
+             colorscale="Greens",
+             customdata=text_matrix.values,
+             hovertemplate='Week Starting: %{x}<br>Day: %{y}<br>Time: %{customdata}<extra></extra>'
+         ))
+         fig_heat.update_xaxes(title_text="Week Starting")
+    else:
+         fig_heat = go.Figure()
+
+    fig_heat.update_layout(height=350, title="Daily Intensity")
+    return fig_heat
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def evolution_figure(evol_data):
+    """Weekly hours per category as a plotly figure dict (px.bar is the expensive build)."""
+    # Sort by WeekStart to ensure chart order
+    evol_data = evol_data.sort_values(['WeekStart', 'Category'])
+    
+    fig_evol = px.bar(
+        evol_data, 
+        x="WeekLabel", 
+        y="Hours", 
+        color="Category", 
+        title="",
+        labels={"WeekLabel": "Week Starting", "Hours": "Total Hours"},
+        hover_data=['Formatted', 'Category']
+    )
+    # Force X-axis order (otherwise it sorts alphabetically by "06 Jan", "13 Jan")
+    # Lucky: Date formats starting with Day often don't sort chronologically if months differ!
+    # e.g. "01 Feb" comes before "31 Jan" alphabetically. 
+    # Must use category_orders.
+    unique_weeks = evol_data.sort_values('WeekStart')['WeekLabel'].unique().tolist()
+    
+    # Also sort Legend by Category if desired, or let Plotly handle.
+    
+    fig_evol.update_xaxes(categoryorder='array', categoryarray=unique_weeks)
+    
+    fig_evol.update_traces(hovertemplate='Week: %{x}<br>Category: %{customdata[1]}<br>Time: %{customdata[0]}<extra></extra>')
+    fig_evol.update_layout(height=350, showlegend=True, legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+    return fig_evol.to_dict()
+
+# Shared across sessions so a new session doesn't re-pull the whole sheet; save_tasks and "Refresh Data" clear it.
+# Short ttl: writes address rows by position, so a new session must not start from rows edited since in the sheet.
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_task_rows(url):
+    get_writer().wait() # Don't read back rows that are still queued for writing
+    return get_worksheet(url).get_all_values()
 
 def load_tasks():
     try:
-        gc = get_gc()
-        secrets = find_credentials(st.secrets)
-        url = secrets.get("spreadsheet") if secrets else None
-        
-        if not url:
-             if "spreadsheet" in st.secrets: url = st.secrets["spreadsheet"]
-             elif "connections" in st.secrets and "gsheets" in st.secrets.connections:
-                 url = st.secrets.connections.gsheets.get("spreadsheet")
-
+        url = get_spreadsheet_url()
         if not url:
             st.error("Spreadsheet URL not found.")
             return []
 
-        sh = gc.open_by_url(url)
-        worksheet = sh.get_worksheet(0)
-        if worksheet.title != "General":
-            worksheet.update_title("General")
-        data = worksheet.get_all_records()
+        ensure_schema(url)
+        rows = fetch_task_rows(url)
+        st.session_state._tasks_load_failed = False
+        headers = rows[0] if rows else []
+        data_rows = rows[1:]
+        col = {h: i for i, h in enumerate(headers)}
+        
+        # Bookkeeping for incremental saves: task i lives in sheet row i + 2
+        st.session_state._sheet_rows = len(data_rows)
+        st.session_state._sheet_keys = [] # What each sheet row holds, checked before it is updated/deleted
+        st.session_state._full_resync = not data_rows or headers != REQUIRED_COLUMNS
+        
+        # MIGRATION LOGIC: Try New Keys -> Fail over to Old Keys
+        def cell(r, *names, default=''):
+            for name in names:
+                i = col.get(name)
+                if i is not None and i < len(r) and r[i] != '':
+                    return r[i]
+            return default
         
         validated_data = []
         active_idx_found = None
         start_time_found = None
         
-        for i, row in enumerate(data):
-            # MIGRATION LOGIC: Try New Keys -> Fail over to Old Keys
-            
+        for i, r in enumerate(data_rows):
             # Duration (Source of Truth)
             # New: 'Duration', Old: 'formatted_time'
-            time_str = str(row.get('Duration') or row.get('formatted_time', '00:00:00'))
-            total_sec = float(parse_time_str(time_str))
+            time_str = cell(r, 'Duration', 'formatted_time', default='00:00:00')
+            total_sec = parse_time_str(time_str)
             
             # Start Epoch
             # New: 'Start Epoch', Old: 'start_epoch'
             try:
-                raw_ep = str(row.get('Start Epoch') or row.get('start_epoch', 0.0) or 0.0).replace(',', '.')
-                start_ep = float(raw_ep)
-            except:
+                start_ep = float(cell(r, 'Start Epoch', 'start_epoch', default='0').replace(',', '.'))
+            except ValueError:
                 start_ep = 0.0
             
             # If start_epoch is set (>0), this task is RUNNING
@@ -400,19 +834,19 @@ def load_tasks():
                 start_time_found = start_ep
             
             clean_row = {
-                'id': str(row.get('ID') or row.get('id', '')),
-                'parent_id': str(row.get('Parent ID') or row.get('parent_id', '')),
-                'name': str(row.get('Task') or row.get('name', '')),
-                'category': str(row.get('Category') or row.get('category', '')),
+                'id': cell(r, 'ID', 'id'),
+                'parent_id': cell(r, 'Parent ID', 'parent_id'),
+                'name': cell(r, 'Task', 'name'),
+                'category': cell(r, 'Category', 'category'),
                 'total_seconds': total_sec,
                 'start_epoch': start_ep,
-                'notes': str(row.get('Notes') or row.get('notes', '')),
-                'created_date': str(row.get('Date Created') or row.get('created_date', '')),
-                'archived': str(row.get('Archived') or row.get('archived', 'False')).lower() == 'true',
-                'archived': str(row.get('Archived') or row.get('archived', 'False')).lower() == 'true',
-                'completion_date': str(row.get('Date Archived') or row.get('completion_date', ''))
+                'notes': cell(r, 'Notes', 'notes'),
+                'created_date': cell(r, 'Date Created', 'created_date'),
+                'archived': cell(r, 'Archived', 'archived', default='False').lower() == 'true',
+                'completion_date': cell(r, 'Date Archived', 'completion_date')
             }
             validated_data.append(clean_row)
+            st.session_state._sheet_keys.append(_row_key(clean_row))
         
         if active_idx_found is not None:
             st.session_state.active_task_idx = active_idx_found
@@ -422,69 +856,139 @@ def load_tasks():
         
     except Exception as e:
         st.warning(f"Could not load data (or empty sheet): {e}")
+        # This session's (empty) copy must never be written back over the sheet
+        st.session_state._tasks_load_failed = True
         return []
 
+def _task_row(task):
+    """Serialize a task dict into a sheet row (REQUIRED_COLUMNS order)."""
+    return [
+        task.get('id', ''),
+        task.get('name', ''),
+        task.get('category', ''),
+        # 'start_epoch' handles the running part; 'total_seconds' is the stored accumulator
+        format_time(task.get('total_seconds', 0)),
+        task.get('start_epoch', 0.0),
+        task.get('notes', ''),
+        task.get('created_date', ''),
+        str(task.get('archived', False)),
+        task.get('completion_date', '')
+    ]
+
+def _row_key(task):
+    """(ID, Task, Category) of a task, as the writer reads them back from columns A:C to check a row."""
+    return [str(task.get(k, '')).strip() for k in ('id', 'name', 'category')]
+
+def mark_task_dirty(index):
+    """Flag a task row so the next save_tasks() rewrites it."""
+    st.session_state._row_dirty.add(index)
+
+def mark_task_deleted(index):
+    """Record that the task at `index` was popped from the list (sheet row index + 2)."""
+    if index < st.session_state._sheet_rows:
+        st.session_state._rows_deleted.append(index)
+        st.session_state._sheet_rows -= 1
+    # Rows below the deleted one shift up by one
+    st.session_state._row_dirty = {i - 1 if i > index else i for i in st.session_state._row_dirty if i != index}
+
+def write_errors():
+    """This session's list of failed background writes, filled in by the SheetWriter thread."""
+    return st.session_state.setdefault("_write_errors", [])
+
 def save_tasks():
+    """Queue pending task changes for the background SheetWriter.
+
+    Only dirty rows are rewritten (one batch_update), new tasks are appended and
+    removed tasks deleted. The whole sheet is rewritten only on a full resync
+    (empty sheet, legacy headers or one of this session's background writes failed).
+    Nothing is written if this session could not load the tasks.
+
+    Updates and deletes address rows by position (task i = row i + 2). Each carries
+    the (ID, Task, Category) this session last saw in that row, and the writer skips
+    them and reports an error (which triggers the full resync) if the row now holds
+    something else, e.g. after rows were added or removed by hand or from another tab.
+    """
+    if st.session_state.get("_tasks_load_failed"):
+        st.error("Tasks could not be loaded from Google Sheets, so changes are not being saved. Use 🔄 Refresh Data to retry.")
+        return
     try:
-        gc = get_gc()
-        
-        # Find URL (logic duplicated for safety, could be helper but inline involves less diff risk)
-        secrets = find_credentials(st.secrets)
-        url = secrets.get("spreadsheet") if secrets else None
-        
-        if not url and "spreadsheet" in st.secrets:
-             url = st.secrets["spreadsheet"]
-        
+        url = get_spreadsheet_url()
         if not url:
             st.error("Spreadsheet URL not found.")
             return
         
-        sh = gc.open_by_url(url)
-        worksheet = sh.get_worksheet(0)
-        if worksheet.title != "General":
-            worksheet.update_title("General")
-        
-        # Prepare data for sheet
-        # Row 1: Headers
-        # Row 2+: Data
+        ensure_schema(url)
+        worksheet = get_worksheet(url)
         
-        headers = REQUIRED_COLUMNS
+        tasks = st.session_state.tasks
+        writer = get_writer()
+        errors = write_errors()
+        fetch_task_rows.clear() # Cached rows are stale once writes are queued
         
-        values = [headers]
-        for task in st.session_state.tasks:
-            # Calculate current total for display/saving (if running, use snapshot)
-            # Actually, save_tasks usually saves the 'base' total_seconds.
-            # If running, we might want to save the *current* elapsed? 
-            # No, 'start_epoch' handles the running part. 'total_seconds' is the stored accumulator.
-            # But the user wants 'formatted_time' to look correct.
-            # We'll formatting the STored total_seconds.
-            
-            t_sec = task.get('total_seconds', 0)
+        if st.session_state._full_resync:
+            # Row 1: Headers, Row 2+: Data
+            writer.put("replace_all", worksheet, [REQUIRED_COLUMNS] + [_task_row(t) for t in tasks], errors=errors)
+            st.session_state._full_resync = False
+            st.session_state._sheet_keys = [_row_key(t) for t in tasks]
+        else:
+            sheet_keys = st.session_state._sheet_keys
+            # Deletions are replayed in the order they happened so row numbers stay valid
+            for index in st.session_state._rows_deleted:
+                writer.put("delete_row", worksheet, index + 2, sheet_keys.pop(index), errors=errors)
             
-            row = [
-                task.get('id', ''),
-                task.get('name', ''),
-                task.get('category', ''),
-                format_time(t_sec), 
-                task.get('start_epoch', 0.0), 
-                task.get('notes', ''),
-                task.get('created_date', ''),
-                # task.get('status', 'To Do'), # Removed
-                str(task.get('archived', False)),
-                task.get('completion_date', '')
-            ]
-            values.append(row)
+            sheet_rows = st.session_state._sheet_rows
+            for i in sorted(st.session_state._row_dirty):
+                if i < sheet_rows:
+                    writer.put("update_row", worksheet, i + 2, _task_row(tasks[i]), sheet_keys[i], errors=errors)
+                    sheet_keys[i] = _row_key(tasks[i])
             
-        worksheet.clear()
-        worksheet.update(values)
+            for t in tasks[sheet_rows:]:
+                writer.put("append_row", worksheet, _task_row(t), errors=errors)
+                sheet_keys.append(_row_key(t))
+        
+        st.session_state._rows_deleted = []
+        st.session_state._sheet_rows = len(tasks)
+        st.session_state._row_dirty = set()
         
     except Exception as e:
         st.error(f"Error saving to Google Sheets: {e}")
 
+def reload_tasks():
+    """Re-read the task sheet (e.g. after it was edited directly) and reset the incremental save bookkeeping."""
+    fetch_task_rows.clear()
+    st.session_state.active_task_idx = None
+    st.session_state.start_time = None
+    st.session_state.tasks = load_tasks()
+    st.session_state._row_dirty = set()
+    st.session_state._rows_deleted = []
+
 # Initialize session state for tasks
 if 'tasks' not in st.session_state:
     st.session_state.tasks = load_tasks()
 
+# Incremental save bookkeeping (load_tasks sets these when the sheet is reachable)
+if '_row_dirty' not in st.session_state:
+    st.session_state._row_dirty = set()
+if '_rows_deleted' not in st.session_state:
+    st.session_state._rows_deleted = []
+if '_sheet_rows' not in st.session_state:
+    st.session_state._sheet_rows = 0
+if '_sheet_keys' not in st.session_state:
+    st.session_state._sheet_keys = []
+if '_full_resync' not in st.session_state:
+    st.session_state._full_resync = False
+
+# Surface this session's failed background writes (emptied in place: the writer thread holds the list)
+failed_writes = write_errors()[:]
+del write_errors()[:len(failed_writes)]
+for failed_ws, message in failed_writes:
+    st.error(f"Error saving to Google Sheets ({failed_ws.title}): {message}")
+# Task rows may now be out of step with the sheet (the writer drops this session's row updates/deletes),
+# so rewrite it from this session's tasks now
+if any(failed_ws is get_worksheet(get_spreadsheet_url()) for failed_ws, _ in failed_writes):
+    st.session_state._full_resync = True
+    save_tasks()
+
 # Initialize session state placeholders if not set by load_tasks
 if 'active_task_idx' not in st.session_state:
     st.session_state.active_task_idx = None
@@ -536,9 +1040,12 @@ def notes_dialog(index):
         )
         
         if st.button("Save Notes", type="primary", use_container_width=True):
-            st.session_state.tasks[index]['notes'] = new_notes
             del st.session_state[f"note_temp_{index}"]
-            save_tasks()
+            # Only write back if the text actually changed
+            if new_notes != task.get('notes', ''):
+                task['notes'] = new_notes
+                mark_task_dirty(index)
+                save_tasks()
             st.rerun()
 
     with tab_preview:
@@ -589,7 +1096,7 @@ def add_sibling_task_dialog(task_id, task_name):
             'name': task_name,
             'category': new_cat,
             # 'status': 'To Do', # Removed
-            'total_seconds': 0.0,
+            'total_seconds': 0,
             'start_epoch': 0.0,
             'notes': '',
             'created_date': current_date
@@ -606,29 +1113,10 @@ def log_session(task_id, task_name, category, elapsed_seconds, start_epoch, end_
     try:
         if elapsed_seconds < 1: return # Ignore accidental clicks
         
-        gc = get_gc()
-        secrets = find_credentials(st.secrets)
-        url = secrets.get("spreadsheet") if secrets else None
-        if not url and "spreadsheet" in st.secrets: url = st.secrets["spreadsheet"]
-        
+        url = get_spreadsheet_url()
         if not url: return
 
-        sh = gc.open_by_url(url)
-        
-        # Get or create 'Logs' worksheet
-        try:
-            ws_logs = sh.worksheet("Logs")
-        except:
-            ws_logs = sh.add_worksheet(title="Logs", rows=1000, cols=6)
-            # New Headers
-            ws_logs.append_row([
-                "ID", 
-                "Task", 
-                "Category", 
-                "Start Time", 
-                "End Time", 
-                "Duration"
-            ])
+        ws_logs = get_log_worksheet(url)
             
         # Format Timestamps: DD/MM/AAAA HH:MM:SS
         # Explicitly convert to Europe/Madrid
@@ -648,18 +1136,26 @@ def log_session(task_id, task_name, category, elapsed_seconds, start_epoch, end_
         # Format Duration: HH:MM:SS
         duration_str = format_time(elapsed_seconds)
         
-        # Append log data
-        ws_logs.append_row([
+        log_row = [
             str(task_id),
             task_name,
             category,
             start_str,
             end_str,
             duration_str
-        ])
+        ]
+        
+        # Queue log data; the writer batches bursts of sessions into one append_rows
+        get_writer().put("append_row", ws_logs, log_row, errors=write_errors())
+        fetch_log_rows.clear()
         
-        # Invalidate cache to force reload on next view
-        st.session_state.logs_data = None
+        # Keep already-loaded logs in sync locally instead of re-downloading the sheet
+        logs = st.session_state.get("logs_data")
+        if isinstance(logs, pd.DataFrame) and list(logs.columns) == LOG_COLUMNS:
+            st.session_state.logs_data = pd.concat([logs, pd.DataFrame([log_row], columns=LOG_COLUMNS)], ignore_index=True)
+        else:
+            # Invalidate cache to force reload on next view
+            st.session_state.logs_data = None
         
     except Exception as e:
         print(f"Log Error: {e}")
@@ -683,6 +1179,7 @@ def delete_confirmation(index):
             st.session_state.active_task_idx -= 1
                 
         st.session_state.tasks.pop(index)
+        mark_task_deleted(index)
         save_tasks()
         st.rerun()
 
@@ -698,7 +1195,7 @@ def edit_task_dialog(index):
     cat_list = st.session_state.get('categories_list', DEFAULT_CATEGORIES)
     try:
         cat_idx = cat_list.index(current_cat)
-    except:
+    except ValueError: # Category was removed since the task was created
         cat_idx = 0
     new_cat = st.selectbox("Category", cat_list, index=cat_idx)
     
@@ -710,6 +1207,7 @@ def edit_task_dialog(index):
         st.session_state.tasks[index]['id'] = new_id
         st.session_state.tasks[index]['name'] = new_name
         st.session_state.tasks[index]['category'] = new_cat
+        mark_task_dirty(index)
         save_tasks()
         st.rerun()
 
@@ -722,13 +1220,14 @@ def archive_confirmation(group_id, group_name):
         current_date_str = datetime.now().strftime("%d/%m/%Y")
         
         # Iterate all tasks and archive matching ones in session state
-        for t in st.session_state.tasks:
+        for i, t in enumerate(st.session_state.tasks):
             t_id = t.get('id', '').strip()
             t_name = t.get('name', '').strip()
             
             if t_id == group_id and t_name == group_name:
                 t['archived'] = True
                 t['completion_date'] = current_date_str
+                mark_task_dirty(i)
                 
         # Handle active task reset if it belonged to this group
         if st.session_state.active_task_idx is not None:
@@ -740,13 +1239,27 @@ def archive_confirmation(group_id, group_name):
         save_tasks()
         st.rerun()
 
+def save_archived_notes(editor_key, indices):
+    """Persist notes edited inline in an archived group's table."""
+    for row, changes in st.session_state[editor_key]['edited_rows'].items():
+        if 'Notes' in changes:
+            idx = indices[row]
+            new_notes = changes['Notes'] or ''
+            if new_notes != st.session_state.tasks[idx].get('notes', ''):
+                st.session_state.tasks[idx]['notes'] = new_notes
+                mark_task_dirty(idx)
+    if st.session_state._row_dirty:
+        save_tasks()
+    # New editor keys: the old edited_rows would otherwise be replayed (over notes-dialog edits) on the next change
+    st.session_state._arch_editor_ver = st.session_state.get("_arch_editor_ver", 0) + 1
+
 def unarchive_group(group_id, group_name):
-    for t in st.session_state.tasks:
+    for i, t in enumerate(st.session_state.tasks):
         if t.get('id', '').strip() == group_id and t.get('name', '').strip() == group_name:
             t['archived'] = False
             t['completion_date'] = ""
+            mark_task_dirty(i)
             
-    save_tasks()
     save_tasks()
     # st.rerun() # Removed: No-op in callback
 
@@ -767,9 +1280,14 @@ def delete_group_confirmation(group_id, group_name):
                  st.session_state.active_task_idx = None
                  st.session_state.start_time = None
         
-        # Remove all tasks matching ID and Name
-        new_tasks = [t for t in st.session_state.tasks if not (t.get('id', '') == group_id and t.get('name', '') == group_name)]
-        st.session_state.tasks = new_tasks
+        # Remove all tasks matching ID and Name (bottom-up so indices stay valid)
+        for i in reversed(range(len(st.session_state.tasks))):
+            t = st.session_state.tasks[i]
+            if t.get('id', '') == group_id and t.get('name', '') == group_name:
+                st.session_state.tasks.pop(i)
+                mark_task_deleted(i)
+                if st.session_state.active_task_idx is not None and st.session_state.active_task_idx > i:
+                    st.session_state.active_task_idx -= 1
         
         save_tasks()
         st.rerun()
@@ -836,6 +1354,28 @@ def create_task_dialog():
 
 # Old delete helpers removed in favor of dialog logic
 
+# Live clock: ticks in the browser so a running timer needs no server reruns
+LIVE_CLOCK_HTML = """
+<style>body {{ margin: 0; padding-top: 6px; }}</style>
+<span id="clock" style="color:#28a745; font-weight:bold; font-family:monospace; font-size:1.1em;"></span>
+<script>
+    const base = {base};
+    const loaded = Date.now(); // Count from page load so client/server clock skew doesn't matter
+    const pad = (n) => String(n).padStart(2, "0");
+    function tick() {{
+        const total = Math.floor(base + (Date.now() - loaded) / 1000);
+        document.getElementById("clock").textContent =
+            pad(Math.floor(total / 3600)) + ":" + pad(Math.floor(total % 3600 / 60)) + ":" + pad(total % 60);
+    }}
+    tick();
+    setInterval(tick, 1000);
+</script>
+"""
+
+def live_clock(elapsed_seconds):
+    """Render a running duration that keeps counting client-side from `elapsed_seconds`."""
+    components.html(LIVE_CLOCK_HTML.format(base=int(elapsed_seconds)), height=34)
+
 def toggle_timer(index):
     # Rule 1: One timer global
     if st.session_state.active_task_idx is not None and st.session_state.active_task_idx != index:
@@ -851,23 +1391,23 @@ def toggle_timer(index):
     
     # Check if we are stopping the CURRENT task
     if st.session_state.active_task_idx == index:
-        prev_idx = st.session_state.active_task_idx
-        prev_start = st.session_state.tasks[prev_idx].get('start_epoch', 0.0)
+        task = st.session_state.tasks[index]
+        prev_start = task.get('start_epoch', 0.0)
         
         # Safety
         if prev_start == 0.0: prev_start = current_time
         
-        elapsed = current_time - prev_start
-        if elapsed < 0: elapsed = 0
+        # Whole seconds: the sheet stores HH:MM:SS, so fractions would be lost on reload anyway
+        elapsed = max(0, int(current_time - prev_start))
         
-        st.session_state.tasks[prev_idx]['total_seconds'] += elapsed
-        st.session_state.tasks[prev_idx]['start_epoch'] = 0.0
+        task['total_seconds'] = int(task['total_seconds']) + elapsed
+        task['start_epoch'] = 0.0
         
-        # Log session
+        # Log session (queued on the same background writer as the task row update below)
         log_session(
-            st.session_state.tasks[prev_idx].get('id', ''),
-            st.session_state.tasks[prev_idx].get('name', ''), 
-            st.session_state.tasks[prev_idx].get('category', ''), 
+            task.get('id', ''),
+            task.get('name', ''), 
+            task.get('category', ''), 
             elapsed,
             prev_start,
             current_time
@@ -882,6 +1422,7 @@ def toggle_timer(index):
         st.session_state.start_time = current_time
         st.session_state.tasks[index]['start_epoch'] = current_time
     
+    mark_task_dirty(index)
     save_tasks()
         
 
@@ -963,6 +1504,7 @@ def manage_categories_dialog():
 # Sidebar Logout & Settings
 with st.sidebar:
     if st.button("🔄 Refresh Data", use_container_width=True):
+         reload_tasks()
          ensure_logs_loaded(force=True)
          # load_categories(force=True) # Optional, if we want to sync categories too
          st.success("Data reloaded from cloud.")
@@ -979,9 +1521,7 @@ with st.sidebar:
         manage_categories_dialog()
         
     # Database Link
-    secrets = find_credentials(st.secrets)
-    url = secrets.get("spreadsheet") if secrets else None
-    if not url and "spreadsheet" in st.secrets: url = st.secrets["spreadsheet"]
+    url = get_spreadsheet_url()
     
     if url:
         st.link_button("📂 DDBB", url, use_container_width=True)
@@ -1014,67 +1554,6 @@ with tab_tracker:
     # Integrated Layout: [New Task Btn] [Date] [Category] [Search] [Archive]
     # Adjust columns to fit
     
-    st.markdown("""
-        <style>
-        /* [AG] Universal Alignment Fix */
-        
-        /* 1. Target the Horizontal Block to align items vertically center */
-        div[data-testid="stHorizontalBlock"] {
-            align-items: center !important;
-        }
-        
-        /* 2. Force ALL Input-like containers to exactly 35px height */
-        /* Text Input, Date Input, Selectbox, MultiSelect */
-        
-        div[data-testid="stTextInput"] div[data-baseweb="input"],
-        div[data-testid="stDateInput"] div[data-baseweb="input"], 
-        div[data-testid="stSelectbox"] div[data-baseweb="select"],
-        div[data-testid="stMultiSelect"] div[data-baseweb="select"] {
-            height: 35px !important;
-            min-height: 35px !important;
-            max-height: 35px !important;
-            border-radius: 4px !important;
-            overflow: hidden !important; /* Prevent chip spillover */
-            display: flex !important;
-            align-items: center !important;
-        }
-
-        /* 3. Button specific overrides */
-        div[data-testid="stButton"] button {
-            height: 35px !important;
-            min-height: 35px !important;
-            max-height: 35px !important;
-            padding: 0px 16px !important;
-            line-height: normal !important; /* Let flex center it */
-            border: 1px solid rgba(250, 250, 250, 0.2);
-            border-radius: 4px !important;
-            display: flex !important;
-            align-items: center !important;
-            justify-content: center !important;
-        }
-        
-        /* 4. Fix input text padding to center text vertically */
-        input {
-            padding-top: 0px !important;
-            padding-bottom: 0px !important;
-            height: 100% !important;
-        }
-        
-        /* 5. Checkbox alignment */
-        label[data-testid="stCheckbox"] {
-            height: 35px !important;
-            display: flex !important;
-            align-items: center !important;
-        }
-        
-        /* 6. Fix for MultiSelect chips pushing height */
-        div[data-baseweb="tag"] {
-            margin-top: 0px !important;
-            margin-bottom: 0px !important;
-            height: 24px !important; /* Smaller chips to fit in 35px */
-        }
-        </style>
-    """, unsafe_allow_html=True)
 
     f_col_new, f_col1, f_col2, f_col3, f_col4 = st.columns([1.2, 1.5, 1.5, 2, 1], vertical_alignment="center")
     
@@ -1112,27 +1591,25 @@ with tab_tracker:
         st.info("No tasks found. Add one to start tracking!")
     else:
         # 1. Filter Logic
+        # Cheapest checks first; the created date is only parsed for tasks that survive the rest
+        filter_cat_set = set(filter_categories)
         filtered_tasks = []
         for i, t in enumerate(st.session_state.tasks):
-            # Match Search
-            match_search = True
-            if search_query:
-                id_match = search_query in str(t.get('id', '')).lower()
-                desc_match = search_query in str(t.get('name', '')).lower()
-                match_search = id_match or desc_match
+            # Match Archive Status
+            if t.get('archived', False) != show_archived:
+                continue
             
             # Match Category
-            match_cat = True
-            if filter_categories:
-                match_cat = t.get('category') in filter_categories
+            if filter_cat_set and t.get('category') not in filter_cat_set:
+                continue
+            
+            # Match Search
+            if search_query and not (search_query in str(t.get('id', '')).lower() or search_query in str(t.get('name', '')).lower()):
+                continue
             
             # Match Date
-            match_date = True
             if filter_date:
-                try:
-                    task_dt = datetime.strptime(t.get('created_date', ''), "%d/%m/%Y").date()
-                except:
-                    task_dt = None
+                task_dt = parse_date_str(t.get('created_date', ''))
                 
                 # Careful: st.date_input with value=[] can return [] or partial tuple
                 # If user hasn't selected anything, filter_date might be empty list -> False
@@ -1140,60 +1617,40 @@ with tab_tracker:
                 
                 if not task_dt:
                      # If task has no date, exclude it if filter is active
-                     match_date = False 
-                else:
-                    if len(filter_date) == 1:
-                        if task_dt != filter_date[0]:
-                            match_date = False
-                    elif len(filter_date) == 2:
-                        start_d, end_d = filter_date
-                        if not (start_d <= task_dt <= end_d):
-                            match_date = False
-            
-            # Match Archive Status
-            is_archived = t.get('archived', False)
-            match_archive = (is_archived == show_archived)
+                     continue
+                if len(filter_date) == 1 and task_dt != filter_date[0]:
+                    continue
+                if len(filter_date) == 2 and not (filter_date[0] <= task_dt <= filter_date[1]):
+                    continue
 
-            if match_search and match_cat and match_date and match_archive:
-                filtered_tasks.append((i, t))
+            filtered_tasks.append((i, t))
 
         if not filtered_tasks:
             st.warning("No tasks match your filters.")
         else:
+            # Stored durations of all visible rows (the running row renders live); format_time is memoized,
+            # which beats a pandas pass at tracker sizes
+            durations = {i: format_time(t['total_seconds']) for i, t in filtered_tasks}
+            
             # Group filtered tasks by (id, name) to avoid duplication
             # groups: dict[key: tuple(id, name)] -> list[tuple(index, task)]
             groups = {}
             for idx, task in filtered_tasks:
                 key = (task.get('id', '').strip(), task.get('name', '').strip())
-                if key not in groups:
-                    groups[key] = []
-                groups[key].append((idx, task))
+                groups.setdefault(key, []).append((idx, task))
             
             # Loop through groups
             # SORTING LOGIC: Always sort by ID (A-Z)
-            sorted_items = sorted(list(groups.items()), key=lambda x: x[0][0])
+            sorted_items = sorted(groups.items(), key=lambda x: x[0][0])
             
             for (g_id, g_name), g_tasks in sorted_items:
-                # Check coverage math
-                total_subtasks = len(g_tasks)
-                completed_subtasks = sum(1 for _, t in g_tasks if t.get('status') == 'Done')
-                
                 # Calculate total group time for header
-                group_total_seconds = 0.0
-                for _, t in g_tasks:
-                    try:
-                        raw_val = str(t.get('total_seconds', 0.0) or 0.0).replace(',', '.')
-                        group_total_seconds += float(raw_val)
-                    except:
-                        pass
+                group_total_seconds = sum(t['total_seconds'] for _, t in g_tasks)
                     
                 # Add running time to group total if any task in group is running
-                running_in_group = False
-                for i, _ in g_tasks:
-                    if i == st.session_state.active_task_idx:
-                        start_t = st.session_state.start_time or time.time()
-                        group_total_seconds += (time.time() - start_t)
-                        running_in_group = True
+                running_in_group = any(i == st.session_state.active_task_idx for i, _ in g_tasks)
+                if running_in_group:
+                    group_total_seconds += time.time() - (st.session_state.start_time or time.time())
                 
                 header_duration = format_time(group_total_seconds)
                 
@@ -1215,47 +1672,82 @@ with tab_tracker:
                         # h_cols[0].markdown("**Category**") # Removed
                         # h_cols[1].markdown("**Duration**") # Removed
                         pass
+                    
+                    if running_in_group:
+                        # The expander label can't host the live clock, so its total stops at this run; tick it here
+                        t_cols = st.columns([3.7, 1.5, 0.7, 0.7, 0.7, 0.7], vertical_alignment="center")
+                        t_cols[0].markdown("**Total**")
+                        with t_cols[1]:
+                            live_clock(group_total_seconds)
                 
                     # Content (Task Rows)
-                    for idx, task in g_tasks:
-                        # if not task.get('category'): continue # FIXED: Don't skip tasks without category
-                        
-                        r_cols = st.columns([3.7, 1.5, 0.7, 0.7, 0.7, 0.7], vertical_alignment="center")
-                        
-                        # Category
-                        cat_name = task.get('category', '')
-                        cat_desc = st.session_state.get('categories_desc', {}).get(cat_name, "")
-                        if cat_desc:
-                             r_cols[0].markdown(f"{cat_name}<br><span style='color:grey; font-size:0.8em;'>{cat_desc}</span>", unsafe_allow_html=True)
-                        else:
-                             r_cols[0].text(cat_name)
+                    if show_archived:
+                        # Archived rows: one table (notes editable inline) instead of a widget row per task;
+                        # the notes dialog and delete act on the task picked in the bar below it
+                        arch_indices = [idx for idx, _ in g_tasks]
+                        arch_key = f"arch_tbl_{g_id}_{g_name}_{st.session_state.get('_arch_editor_ver', 0)}"
+                        st.data_editor(
+                            pd.DataFrame({
+                                'Category': [t.get('category', '') for _, t in g_tasks],
+                                'Duration': [durations[idx] for idx, _ in g_tasks],
+                                'Date Archived': [t.get('completion_date', '') for _, t in g_tasks],
+                                'Notes': [t.get('notes', '') for _, t in g_tasks],
+                            }),
+                            key=arch_key,
+                            on_change=save_archived_notes,
+                            args=(arch_key, arch_indices),
+                            disabled=['Category', 'Duration', 'Date Archived'],
+                            hide_index=True,
+                            use_container_width=True,
+                        )
+                        # Row actions (notes dialog, delete) for the task picked here
+                        a_cols = st.columns([3.7, 1.5, 0.7, 0.7], vertical_alignment="center")
+                        arch_labels = {idx: f"{t.get('category', '') or '—'} · {durations[idx]}" for idx, t in g_tasks}
+                        sel_idx = a_cols[0].selectbox(
+                            "Task",
+                            arch_indices,
+                            format_func=arch_labels.get,
+                            key=f"arch_sel_{g_id}_{g_name}",
+                            label_visibility="collapsed",
+                        )
+                        has_notes = bool(st.session_state.tasks[sel_idx].get('notes', '').strip())
+                        a_cols[2].button("📝" if has_notes else "📄", key=f"arch_note_{g_id}_{g_name}", on_click=notes_dialog, args=(sel_idx,), use_container_width=True)
+                        a_cols[3].button("🗑️", key=f"arch_del_{g_id}_{g_name}", type="secondary", on_click=delete_confirmation, args=(sel_idx,), use_container_width=True)
+                    else:
+                        for idx, task in g_tasks:
+                            # if not task.get('category'): continue # FIXED: Don't skip tasks without category
                         
-                        # Duration
-                        is_running = (idx == st.session_state.active_task_idx)
-                        try: current_total = float(str(task.get('total_seconds', 0.0)).replace(',', '.'))
-                        except: current_total = 0.0
+                            r_cols = st.columns([3.7, 1.5, 0.7, 0.7, 0.7, 0.7], vertical_alignment="center")
                         
-                        if is_running:
-                            current_total += (time.time() - (st.session_state.start_time or time.time()))
+                            # Category
+                            cat_name = task.get('category', '')
+                            cat_desc = st.session_state.get('categories_desc', {}).get(cat_name, "")
+                            if cat_desc:
+                                 r_cols[0].markdown(f"{cat_name}<br><span style='color:grey; font-size:0.8em;'>{cat_desc}</span>", unsafe_allow_html=True)
+                            else:
+                                 r_cols[0].text(cat_name)
                         
-                        dur_str = format_time(current_total)
-                        if is_running:
-                             r_cols[1].markdown(f"<span style='color:#28a745; font-weight:bold; font-family:monospace; font-size:1.1em;'>{dur_str}</span>", unsafe_allow_html=True)
-                        else:
-                             r_cols[1].markdown(f"<span style='font-family:monospace;'>{dur_str}</span>", unsafe_allow_html=True)
+                            # Duration
+                            is_running = (idx == st.session_state.active_task_idx)
+                            if is_running:
+                                 current_total = task['total_seconds'] + (time.time() - (st.session_state.start_time or time.time()))
+                                 with r_cols[1]:
+                                     live_clock(current_total)
+                            else:
+                                 r_cols[1].markdown(f"<span style='font-family:monospace;'>{durations[idx]}</span>", unsafe_allow_html=True)
                         
-                        # Buttons
-                        btn_label = "⏹️" if is_running else "▶️"
-                        btn_type = "primary" if is_running else "secondary"
+                            # Buttons
+                            btn_label = "⏹️" if is_running else "▶️"
+                            btn_type = "primary" if is_running else "secondary"
                         
-                        r_cols[2].button(btn_label, key=f"t_btn_{idx}", type=btn_type, on_click=toggle_timer, args=(idx,), use_container_width=True, disabled=show_archived)
+                            r_cols[2].button(btn_label, key=f"t_btn_{idx}", type=btn_type, on_click=toggle_timer, args=(idx,), use_container_width=True)
                         
-                        has_notes = bool(task.get('notes', '').strip())
-                        note_icon = "📝" if has_notes else "📄"
-                        r_cols[3].button(note_icon, key=f"t_note_{idx}", on_click=notes_dialog, args=(idx,), use_container_width=True)
+                            has_notes = bool(task.get('notes', '').strip())
+                            note_icon = "📝" if has_notes else "📄"
+                            r_cols[3].button(note_icon, key=f"t_note_{idx}", on_click=notes_dialog, args=(idx,), use_container_width=True)
                         
-                        if r_cols[4].button("✏️", key=f"t_edit_{idx}", on_click=edit_task_dialog, args=(idx,), use_container_width=True, disabled=show_archived): pass
-                        if r_cols[5].button("🗑️", key=f"t_del_row_{idx}", type="secondary", on_click=delete_confirmation, args=(idx,), use_container_width=True): pass
+                            if r_cols[4].button("✏️", key=f"t_edit_{idx}", on_click=edit_task_dialog, args=(idx,), use_container_width=True): pass
+                            if r_cols[5].button("🗑️", key=f"t_del_row_{idx}", type="secondary", on_click=delete_confirmation, args=(idx,), use_container_width=True): pass
 
                     st.write("") # Spacer
                     
@@ -1277,43 +1769,14 @@ with tab_tracker:
                         if st.button("🗑️ Delete", key=f"del_grp_{g_id}_{g_name}", type="secondary", use_container_width=True):
                             delete_group_confirmation(g_id, g_name)
 
-with tab_analytics:
+# Analytics renders as a fragment: changing its filters reruns only this tab, not the tracker
+@st.fragment
+def render_analytics():
     # Ensure data is loaded
     ensure_logs_loaded()
     
-    if "logs_data" not in st.session_state or st.session_state.logs_data.empty:
+    if st.session_state.get("logs_data") is None or st.session_state.logs_data.empty:
          st.info("No logs data available yet. Start working on tasks to see analytics!")
-    else:
-        # Process Data from LOGS (Not Tasks)
-        df_log = st.session_state.logs_data.copy()
-        
-        # Schema: ["ID", "Task", "Category", "Start Time", "End Time", "Duration"]
-        # Parse 'Duration' (HH:MM:SS) -> Seconds manually
-        def parse_dur(x):
-            try:
-                parts = str(x).split(':')
-                if len(parts) == 3:
-                     h, m, s = map(int, parts)
-                     return h*3600 + m*60 + s
-            except:
-                pass
-            return 0.0
-            
-        df_log['Seconds'] = df_log['Duration'].apply(parse_dur)
-        # df_log['Seconds'] = pd.to_numeric(df_log['Duration'], errors='coerce').fillna(0) # OLD: Failed because it's HH:MM:SS string
-        
-        df_log['Hours'] = df_log['Seconds'] / 3600.0
-        
-        # Convert Dates
-        # Format in Sheet is "DD/MM/YYYY HH:MM:SS" from log_session
-        
-        # Parse 'Start Time' to datetime
-        df_log['StartDT'] = pd.to_datetime(df_log['Start Time'], format="%d/%m/%Y %H:%M:%S", errors='coerce')
-        # Fallback if format differs?
-        
-        df_log['Date'] = df_log['StartDT'].dt.date
-        df_log['Hour'] = df_log['StartDT'].dt.hour
-        
     
     # helper for presets
     def get_preset_dates(option):
@@ -1346,25 +1809,8 @@ with tab_analytics:
     
     # Category Filter
     if "logs_data" in st.session_state and isinstance(st.session_state.logs_data, pd.DataFrame) and not st.session_state.logs_data.empty:
-        df_log = st.session_state.logs_data.copy()
-        
         # Pre-process Data (Duration/Dates)
-        def parse_dur(x):
-            try:
-                parts = str(x).split(':')
-                if len(parts) == 3:
-                     h, m, s = map(int, parts)
-                     return h*3600 + m*60 + s
-            except:
-                pass
-            return 0.0
-            
-        df_log['Seconds'] = df_log['Duration'].apply(parse_dur)
-        df_log['Hours'] = df_log['Seconds'] / 3600.0
-        
-        df_log['StartDT'] = pd.to_datetime(df_log['Start Time'], format="%d/%m/%Y %H:%M:%S", errors='coerce')
-        df_log['Date'] = df_log['StartDT'].dt.date
-        df_log['Hour'] = df_log['StartDT'].dt.hour
+        df_log = prepare_logs(st.session_state.logs_data)
         
         # FILTERS UI
         with f_col1:
@@ -1381,9 +1827,10 @@ with tab_analytics:
         if date_range:
             if len(date_range) == 2:
                 s, e = date_range
-                df_log = df_log[(df_log['Date'] >= s) & (df_log['Date'] <= e)]
-            elif len(date_range) == 1:
-                df_log = df_log[df_log['Date'] == date_range[0]]
+            else:
+                s = e = date_range[0]
+            # datetime64 compares on StartDT instead of Python date objects
+            df_log = df_log[(df_log['StartDT'] >= pd.Timestamp(s)) & (df_log['StartDT'] < pd.Timestamp(e) + pd.Timedelta(days=1))]
                 
         if sel_cats:
             df_log = df_log[df_log['Category'].isin(sel_cats)]
@@ -1402,64 +1849,17 @@ with tab_analytics:
     else:
 
 
-            # Prepare Data (Global for Analytics)
-            df_log['Seconds'] = df_log['Duration'].apply(parse_dur)
-            df_log['Hours'] = df_log['Seconds'] / 3600.0
-
             # -------------------------------------------------------
             # 1. The "Flow" (Sankey Diagram)
             # -------------------------------------------------------
             st.subheader("🌊 Time Flow (Category ➔ Task)")
             
             # Sankey Data Prep
-            sankey_data = df_log.groupby(['Category', 'Task'])['Seconds'].sum().reset_index()
+            sankey_data = df_log.groupby(['Category', 'Task'], observed=True)['Seconds'].sum().reset_index()
             sankey_data = sankey_data[sankey_data['Seconds'] > 0] 
             
             if not sankey_data.empty:
-                # Calculate Total Flow calculation for %
-                total_flow_seconds = sankey_data['Seconds'].sum()
-                sankey_data['Percentage'] = (sankey_data['Seconds'] / total_flow_seconds) * 100
-                sankey_data['Formatted'] = sankey_data['Seconds'].apply(format_time)
-                
-                all_cats = list(sankey_data['Category'].unique())
-                all_tasks = list(sankey_data['Task'].unique())
-                node_labels = all_cats + all_tasks
-                node_map = {label: i for i, label in enumerate(node_labels)}
-                
-                sources = [node_map[row['Category']] for _, row in sankey_data.iterrows()]
-                targets = [node_map[row['Task']] for _, row in sankey_data.iterrows()]
-                values = (sankey_data['Seconds'] / 3600.0).tolist() # Visual thickness
-                
-                # Prepare Custom Data: [formatted_time, percentage]
-                # We need to map it carefully or just pre-format a string?
-                # Sankey customdata must be list (or array) of length equal to links.
-                # Let's format the hover string directly here for clarity?
-                # Actually, Plotly suggests passing raw data and formatting in template.
-                # Let's pass list of lists: [[time, pct], [time, pct]...]
-                
-                # Zip to list of lists
-                custom_data = sankey_data[['Formatted', 'Percentage']].values.tolist()
-                
-                fig_sankey = go.Figure(data=[go.Sankey(
-                    node = dict(
-                      pad = 15,
-                      thickness = 20,
-                      line = dict(color = "black", width = 0.5),
-                      label = node_labels,
-                      color = "rgba(46, 204, 113, 0.5)",
-                    ),
-                    link = dict(
-                      source = sources,
-                      target = targets,
-                      value = values,
-                      customdata = custom_data,
-                      # %{customdata[0]} = Formatted Time, %{customdata[1]} = Percentage (raw float)
-                      hovertemplate='Source: %{source.label}<br>Target: %{target.label}<br>Time: %{customdata[0]}<br>Share: %{customdata[1]:.1f}%<extra></extra>',
-                      color = "rgba(200, 200, 200, 0.3)" 
-                  ))])
-                
-                fig_sankey.update_layout(title_text="", font_size=12, height=400, margin=dict(l=0, r=0, t=10, b=10))
-                st.plotly_chart(fig_sankey, use_container_width=True)
+                st.plotly_chart(sankey_figure(sankey_data), use_container_width=True)
             else:
                 st.info("Not enough data for Flow Chart.")
 
@@ -1475,85 +1875,23 @@ with tab_analytics:
             # -------------------------------------------------------
             st.subheader("🔥 Intensity Map")
             # Prepare Data: Date, Hours
-            heat_data = df_log.groupby('Date')['Seconds'].sum().reset_index()
-            heat_data['Hours'] = heat_data['Seconds'] / 3600.0
-            heat_data['Formatted'] = heat_data['Seconds'].apply(format_time)
-            
-            heat_data['Date'] = pd.to_datetime(heat_data['Date'])
-            heat_data['WeekStart'] = heat_data['Date'].dt.to_period('W').apply(lambda r: r.start_time)
-            # Format to "06 Jan"
-            heat_data['WeekLabel'] = heat_data['WeekStart'].dt.strftime("%d %b")
-            heat_data['Day'] = heat_data['Date'].dt.day_name()
+            # (week columns come from prepare_logs; heatmap_figure's pivot fixes the order, so no sort here)
+            heat_data = df_log.groupby(['Date', 'WeekStart', 'WeekLabel'], sort=False)['Seconds'].sum().reset_index()
+            heat_data['Hours'] = heat_data['Seconds'] * (1.0 / 3600.0)
+            heat_data['Formatted'] = format_time_series(heat_data['Seconds'])
+            heat_data['Day'] = pd.to_datetime(heat_data['Date']).dt.day_name()
             
-            days_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-            
-            # Create full grid for Heatmap
-            if not heat_data.empty:
-                 # Pivot on WeekLabel (Formatted String)
-                 # We must carry sorting by also pivoting on WeekStart and then replacing index? 
-                 # Easier: Just pivot on `WeekLabel`. Sorting relies on `x` argument in Heatmap.
-                 
-                 # To ensure correct sort order of "06 Jan", "13 Jan", we need unique list sorted by date
-                 week_map = heat_data[['WeekStart', 'WeekLabel']].drop_duplicates().sort_values('WeekStart')
-                 sorted_labels = week_map['WeekLabel'].tolist()
-                 
-                 z_matrix = heat_data.pivot(index='Day', columns='WeekLabel', values='Hours').reindex(index=days_order, columns=sorted_labels)
-                 text_matrix = heat_data.pivot(index='Day', columns='WeekLabel', values='Formatted').reindex(index=days_order, columns=sorted_labels).fillna("0s")
-                 
-                 z_values = z_matrix.fillna(0).values
-                 
-                 fig_heat = go.Figure(data=go.Heatmap(
-                     z=z_values,
-                     x=z_matrix.columns, # Now these are strings "06 Jan", "13 Jan"
-                     y=z_matrix.index,
-                     colorscale="Greens",
-                     customdata=text_matrix.values,
-                     hovertemplate='Week Starting: %{x}<br>Day: %{y}<br>Time: %{customdata}<extra></extra>'
-                 ))
-                 fig_heat.update_xaxes(title_text="Week Starting")
-            else:
-                 fig_heat = go.Figure()
-
-            fig_heat.update_layout(height=350, title="Daily Intensity")
-            st.plotly_chart(fig_heat, use_container_width=True)
+            st.plotly_chart(heatmap_figure(heat_data), use_container_width=True)
             
             st.markdown("---")
                 
             st.subheader("📈 Strategy Evolution")
-            df_log['WeekStart'] = df_log['StartDT'].dt.to_period('W').apply(lambda r: r.start_time)
-            # Format to "06 Jan"
-            df_log['WeekLabel'] = df_log['WeekStart'].dt.strftime("%d %b")
-            
-            evol_data = df_log.groupby(['WeekLabel', 'WeekStart', 'Category'])['Seconds'].sum().reset_index()
-            evol_data['Hours'] = evol_data['Seconds'] / 3600.0
-            evol_data['Formatted'] = evol_data['Seconds'].apply(format_time)
+            evol_data = df_log.groupby(['WeekLabel', 'WeekStart', 'Category'], sort=False, observed=True)['Seconds'].sum().reset_index()
+            evol_data['Hours'] = evol_data['Seconds'] * (1.0 / 3600.0)
+            evol_data['Formatted'] = format_time_series(evol_data['Seconds'])
             
             if not evol_data.empty:
-                # Sort by WeekStart to ensure chart order
-                evol_data = evol_data.sort_values('WeekStart')
-                
-                fig_evol = px.bar(
-                    evol_data, 
-                    x="WeekLabel", 
-                    y="Hours", 
-                    color="Category", 
-                    title="",
-                    labels={"WeekLabel": "Week Starting", "Hours": "Total Hours"},
-                    hover_data=['Formatted', 'Category']
-                )
-                # Force X-axis order (otherwise it sorts alphabetically by "06 Jan", "13 Jan")
-                # Lucky: Date formats starting with Day often don't sort chronologically if months differ!
-                # e.g. "01 Feb" comes before "31 Jan" alphabetically. 
-                # Must use category_orders.
-                unique_weeks = evol_data.sort_values('WeekStart')['WeekLabel'].unique().tolist()
-                
-                # Also sort Legend by Category if desired, or let Plotly handle.
-                
-                fig_evol.update_xaxes(categoryorder='array', categoryarray=unique_weeks)
-                
-                fig_evol.update_traces(hovertemplate='Week: %{x}<br>Category: %{customdata[1]}<br>Time: %{customdata[0]}<extra></extra>')
-                fig_evol.update_layout(height=350, showlegend=True, legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
-                st.plotly_chart(fig_evol, use_container_width=True)
+                st.plotly_chart(evolution_figure(evol_data), use_container_width=True)
             else:
                 st.info("No data for evolution.")
 
@@ -1563,30 +1901,16 @@ with tab_analytics:
             
             st.markdown("---")
 
-
+with tab_analytics:
+    render_analytics()
 
 
 with tab_logs:
     ensure_logs_loaded()
     
     if "logs_data" in st.session_state and isinstance(st.session_state.logs_data, pd.DataFrame) and not st.session_state.logs_data.empty:
-        df_log = st.session_state.logs_data.copy()
-        
-        # Prepare columns (reuse logic)
-        def parse_dur_log(x):
-            try:
-                parts = str(x).split(':')
-                if len(parts) == 3:
-                     h, m, s = map(int, parts)
-                     return h*3600 + m*60 + s
-            except:
-                pass
-            return 0.0
-            
-        df_log['Seconds'] = df_log['Duration'].apply(parse_dur_log)
-        df_log['Hours'] = df_log['Seconds'] / 3600.0
-        df_log['StartDT'] = pd.to_datetime(df_log['Start Time'], format="%d/%m/%Y %H:%M:%S", errors='coerce')
-        df_log['Date'] = df_log['StartDT'].dt.date
+        # Prepare columns (shared, cached with the Analytics tab)
+        df_log = prepare_logs(st.session_state.logs_data)
         
         # Filters UI
         f_col1, f_col2, f_col3 = st.columns(3)
@@ -1602,9 +1926,10 @@ with tab_logs:
         if log_date_range:
             if len(log_date_range) == 2:
                 s, e = log_date_range
-                df_log = df_log[(df_log['Date'] >= s) & (df_log['Date'] <= e)]
-            elif len(log_date_range) == 1:
-                df_log = df_log[df_log['Date'] == log_date_range[0]]
+            else:
+                s = e = log_date_range[0]
+            # datetime64 compares on StartDT instead of Python date objects
+            df_log = df_log[(df_log['StartDT'] >= pd.Timestamp(s)) & (df_log['StartDT'] < pd.Timestamp(e) + pd.Timedelta(days=1))]
                 
         if log_sel_cats:
             df_log = df_log[df_log['Category'].isin(log_sel_cats)]
@@ -1623,10 +1948,11 @@ with tab_logs:
                 column_config={
                     "Start Time": st.column_config.DatetimeColumn(format="D/M/YYYY HH:mm:ss"),
                     "End Time": st.column_config.DatetimeColumn(format="D/M/YYYY HH:mm:ss"),
-                     "Hours": None,
                      "Seconds": None, # Hide helper
                      "StartDT": None,
-                     "Date": None
+                     "Date": None,
+                     "WeekStart": None,
+                     "WeekLabel": None
                 }
             )
         else:
@@ -1636,10 +1962,6 @@ with tab_logs:
 
 
 
-# Auto-refresh if timer is running
-if st.session_state.active_task_idx is not None:
-    time.sleep(1)
-    st.rerun()
 
 
 